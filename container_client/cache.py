@@ -0,0 +1,183 @@
+"""
+Optional on disk cache for slowly changing API data (server environment, images, profiles, networks).
+
+Entries are stored in sqlite keyed by connection target and API path so short lived processes can start with a warm view of the server.
+"""
+
+# sqlite is part of the standard library, so no extra dependencies are needed
+import sqlite3
+import threading
+import time
+import json
+
+# Cached entries are handed back to callers as Response objects, same as a live request
+import requests
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache():
+  """Disk backed cache of GET responses
+
+  path is the sqlite file to store entries in; it is created if missing.
+  max_size (default 8MiB) caps the total size of cached bodies, least recently used entries are evicted first.
+  max_age (default 300) is the number of seconds an entry can be served without asking the server, counted from when it was stored or last
+    confirmed by the server. This is what saves round trips when a process starts. None means every entry is checked against the server the
+    first time a process uses it.
+  paths (default CACHED_PATHS) are the API paths, relative to the API version, which will be cached.
+  timeout (default 0.1) is how many seconds to wait for another process using the same file before giving up.
+
+  Older entries are checked by sending their ETag in If-None-Match. That only saves the body being sent again if the server answers 304; Incus
+  and LXD don't send an ETag for list endpoints (images, profiles, networks) and don't answer 304, so in practice the entry is fetched again.
+
+  sqlite errors (a locked or corrupt file) are logged and treated as a cache miss, so requests fall back to asking the server.
+  """
+
+  # Slowly changing metadata commonly fetched at startup. '' is the server environment (GET /1.0)
+  CACHED_PATHS = ( '', 'images', 'images?recursion=1', 'profiles', 'profiles?recursion=1', 'networks', 'networks?recursion=1' )
+
+  def __init__(self, path, max_size=8 * 1024 * 1024, max_age=300, paths=CACHED_PATHS, timeout=0.1):
+    self.path = path
+    self.max_size = max_size
+    self.max_age = max_age
+    self.paths = paths
+
+    # Key = (target, path) checked against the server by this process, Value = when it was checked
+    self._validated = {}
+    self._lock = threading.Lock()
+
+    try:
+      self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+    except sqlite3.Error as se:
+      logging.warning('Unable to open cache {}, error {}'.format(path, se))
+      self._connection = None
+      return
+
+    try:
+      # WAL lets other processes read while one is writing
+      self._connection.execute('PRAGMA journal_mode=WAL')
+      with self._connection:
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                                 'target TEXT, path TEXT, etag TEXT, headers TEXT, content BLOB, size INTEGER, stored REAL, used REAL, '
+                                 'PRIMARY KEY (target, path))')
+    except sqlite3.Error as se:
+      logging.warning('Unable to set up cache {}, error {}'.format(path, se))
+
+  def cacheable(self, api_path):
+    """Return True when api_path should be cached."""
+    return api_path in self.paths
+
+  def get(self, target, path):
+    """Look up an entry
+
+    Returns a dict with etag, headers, content and stored keys, or None when there is nothing cached.
+    """
+
+    if self._connection is None:
+      return None
+
+    with self._lock:
+      try:
+        row = self._connection.execute('SELECT etag, headers, content, stored FROM entries WHERE target = ? AND path = ?',
+                                       (target, path)).fetchone()
+      except sqlite3.Error as se:
+        logging.warning('Unable to read {} from cache, error {}'.format(path, se))
+        return None
+
+      if row is None:
+        return None
+
+      # Only affects eviction order, so failing to record use is not a reason to skip the entry
+      try:
+        with self._connection:
+          self._connection.execute('UPDATE entries SET used = ? WHERE target = ? AND path = ?', (time.time(), target, path))
+      except sqlite3.Error as se:
+        logging.info('Unable to update cache use time for {}, error {}'.format(path, se))
+
+    return { 'etag': row[0], 'headers': json.loads(row[1]), 'content': row[2], 'stored': row[3] }
+
+  def fresh(self, target, path, entry):
+    """Return True if entry can be used without asking the server."""
+
+    with self._lock:
+      checked = self._validated.get((target, path))
+
+    if self.max_age is None:
+      return checked is not None
+
+    return time.time() - max(entry['stored'], checked or 0) < self.max_age
+
+  def validated(self, target, path):
+    """Record that the server confirmed an entry is current."""
+
+    with self._lock:
+      self._validated[(target, path)] = time.time()
+
+  def store(self, target, path, response):
+    """Save a successful response, evicting old entries if the cache is over max_size."""
+
+    if self._connection is None:
+      return
+
+    content = response.content
+    if len(content) > self.max_size:
+      logging.info('Response for {} is larger than the cache, not storing it'.format(path))
+      return
+
+    now = time.time()
+    with self._lock:
+      try:
+        with self._connection:
+          self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (target, path, response.headers.get('ETag'), json.dumps(dict(response.headers)), content, len(content),
+                                    now, now))
+          self._evict()
+      except sqlite3.Error as se:
+        logging.warning('Unable to store {} in cache, error {}'.format(path, se))
+        return
+
+      self._validated[(target, path)] = now
+
+  def invalidate(self, target, path=''):
+    """Remove entries for target whose path starts with path; by default all of them."""
+
+    with self._lock:
+      # Forget validation first so a failed delete still makes us ask the server
+      for key in [ key for key in self._validated if key[0] == target and key[1].startswith(path) ]:
+        del self._validated[key]
+
+      if self._connection is None:
+        return
+
+      try:
+        with self._connection:
+          self._connection.execute("DELETE FROM entries WHERE target = ? AND path LIKE ? ESCAPE '\\'",
+                                   (target, path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'))
+      except sqlite3.Error as se:
+        logging.warning('Unable to remove {} from cache, error {}'.format(path, se))
+
+  def response(self, entry):
+    """Build a ``requests.Response`` from a cached entry."""
+
+    response = requests.models.Response()
+    response.status_code = 200
+    response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+    response._content = entry['content']
+    response.encoding = 'utf-8'
+    return response
+
+  def close(self):
+    if self._connection is not None:
+      self._connection.close()
+
+  def _evict(self):
+    # Caller holds the lock. Drop least recently used entries until we're under max_size
+    total = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+    while total > self.max_size:
+      target, path, size = self._connection.execute('SELECT target, path, size FROM entries ORDER BY used LIMIT 1').fetchone()
+      logging.info('Evicting {} {} from cache'.format(target, path))
+      self._connection.execute('DELETE FROM entries WHERE target = ? AND path = ?', (target, path))
+      self._validated.pop((target, path), None)
+      total -= size
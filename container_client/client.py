@@ -17,16 +17,182 @@ import requests
 # Used to encode socket path
 from urllib.parse import quote_plus
 
+# Sends requests; can be swapped to record or replay API traffic
+from container_client.transport import Transport
+
 # Error handling; flows in via requests_unixsocket
 import urllib3.exceptions
 import requests.exceptions
 import ssl
 
+# Operations may be checked from several scheduler threads
+import threading
+
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class Operation():
+  """Handle for a background (async) operation started by ``Client.request``.
+
+  Returned by ``request`` when the API answers with one of ``Client.HTTP_SUCCESSFUL_BACKGROUND_CODES``. Attribute access not handled here
+  (``status_code``, ``json()``, ``headers`` ...) is passed through to the original ``requests.Response`` so existing callers keep working.
+
+  client is the ``Client`` which started the operation and is used for follow up calls.
+  response is the ``requests.Response`` returned when the operation was created.
+  cache_invalidation (default None) is a (target, path) pair removed from ``client.cache`` when the operation finishes, as the data it changes
+    may have been cached again while it ran.
+  """
+
+  # Operation status codes (see Client.API_STATUS_CODES) which mean no further progress will be made
+  FINISHED_STATUS_CODES = [ 200, 400, 401 ]
+
+  def __init__(self, client, response, cache_invalidation=None):
+    self.client = client
+    self.response = response
+    self.cache_invalidation = cache_invalidation
+    # Most recent operation metadata returned by the API; refreshed by status() and wait()
+    self.operation = response.json().get('metadata') or {}
+    self.id = self.operation.get('id')
+    self._done_callbacks = []
+    # Guards the done check and callback handoff between threads
+    self._lock = threading.Lock()
+
+    # Final response from the API; the operation may have finished before it was returned to us
+    self.result = None
+    if self.done():
+      self.result = response
+      self._invalidate_cache()
+
+  def __getstate__(self):
+    # Locks can't be copied or pickled; each copy gets its own
+    state = self.__dict__.copy()
+    state.pop('_lock', None)
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+
+  def __getattr__(self, name):
+    # Only called when normal lookup fails; fall back to the wrapped response.
+    # copy and pickle look up attributes before __init__ has run, so response may not exist yet
+    if name == 'response':
+      raise AttributeError(name)
+    return getattr(self.response, name)
+
+  def __repr__(self):
+    return '<Operation {} ({})>'.format(self.id, self.operation.get('status'))
+
+  @property
+  def metadata(self):
+    """Operation specific metadata, eg ``download_progress`` while an image is fetched."""
+    return self.operation.get('metadata') or {}
+
+  def done(self):
+    """Return True once the operation has succeeded, failed or been cancelled."""
+    return self.operation.get('status_code') in self.FINISHED_STATUS_CODES
+
+  def status(self):
+    """Non blocking status check
+
+    Fetches the current state of the operation, updating ``metadata``. Returns the status text (eg 'Running') or ``None`` on error.
+    """
+
+    if self.done():
+      return self.operation.get('status')
+
+    op_status = self.client.request(api_path='operations/{}'.format(self.id))
+    if op_status is None:
+      logging.warning('Unable to fetch status of operation {}'.format(self.id))
+      return None
+
+    self._update(op_status)
+    return self.operation.get('status')
+
+  def wait(self, timeout=None):
+    """Block until the operation finishes
+
+    timeout (default None) is the number of seconds the server should wait before returning the current state; None waits until done.
+
+    Returns the ``requests.Response`` from the API or ``None`` on error. Check ``done()`` to tell a timeout from completion.
+    """
+
+    if self.done():
+      return self.result
+
+    api_path = 'operations/{}/wait'.format(self.id)
+    if timeout is not None:
+      api_path = '{}?timeout={}'.format(api_path, timeout)
+
+    logging.info('Waiting for operation {} to complete'.format(self.id))
+    op_status = self.client.request(api_path=api_path)
+    if op_status is None:
+      logging.warning('Wait failed on operation {}'.format(self.id))
+      return None
+
+    self._update(op_status)
+    return op_status
+
+  def cancel(self):
+    """Ask the server to cancel the operation
+
+    Returns True when the server accepted the request, False otherwise.
+    """
+
+    if self.done():
+      logging.info('Operation {} has already finished, not cancelling'.format(self.id))
+      return False
+
+    if self.client.request(request_type='DELETE', api_path='operations/{}'.format(self.id)) is None:
+      logging.warning('Unable to cancel operation {}'.format(self.id))
+      return False
+
+    return True
+
+  def add_done_callback(self, callback):
+    """Call ``callback(operation)`` once the operation finishes
+
+    Callbacks are run from whichever ``status()`` or ``wait()`` call sees the operation finish; if it already has, the callback runs immediately.
+    """
+
+    with self._lock:
+      if not self.done():
+        self._done_callbacks.append(callback)
+        return
+
+    self._run_callback(callback)
+
+  def _update(self, op_status):
+    # Store latest operation state and run callbacks if it has now finished
+    operation = op_status.json().get('metadata') or {}
+
+    with self._lock:
+      self.operation = operation
+      if not self.done():
+        return
+      self.result = op_status
+      # Only the first caller to see the operation finish takes the callbacks
+      callbacks, self._done_callbacks = self._done_callbacks, []
+
+    self._invalidate_cache()
+    for callback in callbacks:
+      self._run_callback(callback)
+
+  def _run_callback(self, callback):
+    # A failing callback shouldn't break whoever happened to notice the operation finish
+    try:
+      callback(self)
+    except Exception as cbe:
+      logging.warning('Callback for operation {} raised {}'.format(self.id, cbe))
+
+  def _invalidate_cache(self):
+    # Data changed by this operation may have been cached again while it ran
+    if self.cache_invalidation is not None and self.client.cache is not None:
+      self.client.cache.invalidate(*self.cache_invalidation)
+
+
 class Client():
   """Container for API communication.
 
@@ -63,6 +229,12 @@ class Client():
   client_auth_certificates = None
   server_verification = None
 
+  # Optional container_client.cache.DiskCache used for slowly changing GET requests
+  cache = None
+
+  # Sends requests on behalf of request(); see container_client.transport for recording and replaying traffic
+  transport = Transport()
+
   # Where is the server? can be overriden. UNIX socket or https URIs are supported
   connection_target = '/var/lib/incus/unix.socket'
 
@@ -126,6 +298,9 @@ class Client():
       logging.info('Data is "False"; perhaps this was called on the output of a failed function?')
       return False
 
+    if isinstance(returned_data, Operation):
+      return returned_data.wait()
+
     if returned_data.status_code not in self.HTTP_SUCCESSFUL_BACKGROUND_CODES:
       logging.info('Data has a status code of {}, polling is not necesary'.format(returned_data.status_code))
       return returned_data
@@ -177,7 +352,8 @@ class Client():
     client_auth_certificates (default None) is a path to a pem or a tuple of client cert, client key.
     server_verification (default False) when a path to a server certificate is provided, turns on verification
 
-    Returns ``requests.Response`` (provided by Python ``requests`` or ``requests_unixsocket``) or ``None`` on error.
+    Returns ``requests.Response`` (provided by Python ``requests`` or ``requests_unixsocket``) or ``None`` on error. Background tasks (status
+    codes in HTTP_SUCCESSFUL_BACKGROUND_CODES) return an ``Operation`` wrapping the response unless skip_result_validation is set.
     """
 
     # Pull connection target from object
@@ -187,14 +363,33 @@ class Client():
     if post_json is None and request_type in ['PUT', 'PATCH', 'POST']:
       logging.info('This request type ({}) requires post_json be provided'.format(request_type))
 
+    # Look for a cached copy; if it can't be used as is, ask the server whether it has changed
+    headers = None
+    cache_entry = None
+    cache_path = '{}/{}'.format(api_version, api_path)
+    use_cache = self.cache is not None and request_type == 'GET' and skip_result_validation is False and self.cache.cacheable(api_path)
+    if use_cache:
+      cache_entry = self.cache.get(connection_target, cache_path)
+      if cache_entry is not None:
+        if self.cache.fresh(connection_target, cache_path, cache_entry):
+          logging.info('Using cached response for {}'.format(cache_path))
+          return self.cache.response(cache_entry)
+        if cache_entry['etag'] is not None:
+          headers = { 'If-None-Match': cache_entry['etag'] }
+    cache_invalidation = None
+    if self.cache is not None and request_type != 'GET':
+      # Writes may change cached data; drop anything under the same top level path now and again once any background operation finishes
+      cache_invalidation = (connection_target, '{}/{}'.format(api_version, api_path.split('?')[0].split('/')[0]))
+      self.cache.invalidate(*cache_invalidation)
+
     # import `re` and match on > 1st char?
     if connection_target.startswith('/'):
       # Use unix socket ; this is the default behaviour
       self.session = requests_unixsocket.Session()
 
       try:
-        request_result = self.session.request(request_type,
-                                'http+unix://{0}/{1}/{2}'.format(quote_plus(connection_target), api_version, api_path), json=post_json)
+        request_result = self.transport.request(self.session, request_type,
+                                'http+unix://{0}/{1}/{2}'.format(quote_plus(connection_target), api_version, api_path), body=post_json, headers=headers)
       except ( urllib3.exceptions.ProtocolError, requests.exceptions.ConnectionError) as uepe:
         logging.warning('Unable to connect to socket at {}, error {}'.format(connection_target, uepe))
         # Raise error to caller?
@@ -209,8 +404,8 @@ class Client():
 
       # TODO: catch exceptions when port is wrong/absent
       try:
-        request_result = self.session.request(request_type,
-                                '{0}/{1}/{2}'.format(connection_target, api_version, api_path), json=post_json)
+        request_result = self.transport.request(self.session, request_type,
+                                '{0}/{1}/{2}'.format(connection_target, api_version, api_path), body=post_json, headers=headers)
       # except (urllib3.exceptions.ProtocolError, requests.exceptions.ConnectionError) as uepe:
       except urllib3.exceptions.ProtocolError as uepe:
         logging.error('Unable to connect to remote server at {}, error {}'.format(connection_target, uepe))
@@ -242,13 +437,27 @@ class Client():
     # logging.debug('Request result headers: {}'.format(request_result.headers))
     # logging.debug('Request result full: {}'.format(request_result.__dict__))
 
+    # A read made while this write was in flight may have cached the old data; background writes are handled by Operation when they finish
+    if cache_invalidation is not None and request_result.status_code not in self.HTTP_SUCCESSFUL_BACKGROUND_CODES:
+      self.cache.invalidate(*cache_invalidation)
+
     # We don't always want validation, it may not be appropriate (eg pulling logs seems to cause this)
     if skip_result_validation is True:
       logging.info('Skipping validation and returning')
       return request_result
 
+    # Server confirmed our cached copy is current
+    if cache_entry is not None and request_result.status_code == 304:
+      logging.info('Cached response for {} is current'.format(cache_path))
+      self.cache.validated(connection_target, cache_path)
+      return self.cache.response(cache_entry)
+
     # Check return codes are in order
     if self.validate(request_result) is True:
+      if request_result.status_code in self.HTTP_SUCCESSFUL_BACKGROUND_CODES:
+        return Operation(self, request_result, cache_invalidation=cache_invalidation)
+      if use_cache and request_result.status_code in self.HTTP_SUCCESSFUL_SYNCHRONOUS_CODES:
+        self.cache.store(connection_target, cache_path, request_result)
       return request_result
     else:
       logging.warning('Request validate failed on {}'.format(request_result.__dict__))
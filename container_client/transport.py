@@ -0,0 +1,140 @@
+"""
+Transports used by ``Client.request`` to send requests.
+
+``Transport`` sends requests using the client's ``requests`` session. ``RecordingTransport`` does the same while keeping a copy of every
+request/response pair which can be saved to a file, and ``ReplayTransport`` serves a saved file back from memory without a running server.
+"""
+
+import base64
+import json
+import time
+import datetime
+import threading
+
+# Replay matches on the API path, not the server it was recorded from
+from urllib.parse import urlsplit
+
+# Replayed answers are handed back as Response objects, same as a live request
+import requests
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Transport():
+  """Send requests with the session set up by ``Client.request``."""
+
+  def request(self, session, method, url, body=None, headers=None):
+    """Send a request
+
+    session is the ``requests.Session`` (or ``requests_unixsocket.Session``) prepared by the client.
+    method, url and headers are passed to ``session.request``, body is passed as its json parameter.
+
+    Returns a ``requests.Response``; connection errors are raised to the client as they would be by ``requests``.
+    """
+
+    return session.request(method, url, json=body, headers=headers)
+
+
+class RecordingTransport(Transport):
+  """Send requests to the server and record them
+
+  path is the file ``save()`` writes the recording to.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.interactions = []
+
+  def request(self, session, method, url, body=None, headers=None):
+    response = super().request(session, method, url, body=body, headers=headers)
+
+    self.interactions.append({
+      'method': method,
+      'url': url,
+      'json': body,
+      'status_code': response.status_code,
+      'headers': dict(response.headers),
+      'content': base64.b64encode(response.content).decode('ascii'),
+      'elapsed': response.elapsed.total_seconds(),
+    })
+    return response
+
+  def save(self):
+    """Write recorded interactions to path."""
+
+    logging.info('Saving {} interactions to {}'.format(len(self.interactions), self.path))
+    with open(self.path, 'w') as recording:
+      json.dump({ 'interactions': self.interactions }, recording)
+
+
+class ReplayTransport(Transport):
+  """Serve a recording made by ``RecordingTransport`` from memory
+
+  path is the recording to load.
+  realtime (default False) sleeps for the recorded response time before answering; by default answers are immediate.
+
+  Requests are matched on method, API path (with query string) and json body. The connection target (socket path or https host) is not part of
+  the match, so a recording can be replayed by a client with a different ``connection_target``. When the same request was recorded more than once (eg polling an operation) the answers
+  are given in the order they were recorded, starting again from the first once they run out. Requests which were not recorded raise
+  ``requests.exceptions.ConnectionError`` as an unreachable server would.
+
+  Replay can be shared between threads. Each recorded answer is built once and the same ``requests.Response`` is given to every caller
+  asking for it, so callers should not modify it.
+  """
+
+  def __init__(self, path, realtime=False):
+    self.path = path
+    self.realtime = realtime
+
+    with open(path) as recording:
+      interactions = json.load(recording)['interactions']
+
+    # Key = (method, API path, json body), Value = list of (response, elapsed) in recorded order
+    self.responses = {}
+    for interaction in interactions:
+      key = self._key(interaction['method'], interaction['url'], interaction['json'])
+      self.responses.setdefault(key, []).append((self._response(interaction), interaction['elapsed']))
+
+    # Next answer to give for each key
+    self._positions = dict.fromkeys(self.responses, 0)
+    self._lock = threading.Lock()
+
+  def request(self, session, method, url, body=None, headers=None):
+    key = self._key(method, url, body)
+
+    if key not in self.responses:
+      raise requests.exceptions.ConnectionError('No recorded response for {} {} in {}'.format(method, key[1], self.path))
+
+    answers = self.responses[key]
+    with self._lock:
+      position = self._positions[key]
+      self._positions[key] = (position + 1) % len(answers)
+
+    response, elapsed = answers[position]
+    if self.realtime is True:
+      time.sleep(elapsed)
+    return response
+
+  def _key(self, method, url, body):
+    # Drop scheme and target; a target with a trailing slash gives an extra leading '/'
+    parts = urlsplit(url)
+    path = parts.path.lstrip('/')
+    if parts.query:
+      path = '{}?{}'.format(path, parts.query)
+
+    if body is None:
+      return (method, path, None)
+    return (method, path, json.dumps(body, sort_keys=True))
+
+  def _response(self, interaction):
+    # Build the Response once when loading so replay only does a lookup
+    response = requests.models.Response()
+    response.status_code = interaction['status_code']
+    response.headers = requests.structures.CaseInsensitiveDict(interaction['headers'])
+    response._content = base64.b64decode(interaction['content'])
+    response.encoding = 'utf-8'
+    response.url = interaction['url']
+    response.elapsed = datetime.timedelta(seconds=interaction['elapsed'])
+    return response
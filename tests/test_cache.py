@@ -0,0 +1,206 @@
+import sqlite3
+import time
+
+import pytest
+
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from container_client.cache import DiskCache
+from container_client.client import Client
+
+# Build a real requests.Response as the API would return it
+def api_response(content=b'{"metadata": {}}', status_code=200, etag=None):
+  response = requests.models.Response()
+  response.status_code = status_code
+  response._content = content
+  if etag is not None:
+    response.headers['ETag'] = etag
+  return response
+
+@pytest.fixture
+def cache(tmp_path):
+  disk_cache = DiskCache(str(tmp_path / 'cache.sqlite'))
+  yield disk_cache
+  disk_cache.close()
+
+### Tests for DiskCache on its own
+
+def test_cache_empty(cache):
+  assert cache.get('target', '1.0/') is None
+
+def test_cache_cacheable(cache):
+  assert cache.cacheable('') is True
+  assert cache.cacheable('profiles') is True
+  assert cache.cacheable('instances') is False
+
+def test_cache_store_and_get(cache):
+  cache.store('target', '1.0/profiles', api_response(etag='"abc"'))
+  entry = cache.get('target', '1.0/profiles')
+  assert entry['etag'] == '"abc"'
+  assert cache.response(entry).json() == { 'metadata': {} }
+  assert cache.response(entry).headers['etag'] == '"abc"'
+  # Keyed by target as well as path
+  assert cache.get('other-target', '1.0/profiles') is None
+
+# A new process starts with nothing validated, so entries need checking with the server
+def test_cache_persists_but_needs_validation(tmp_path):
+  path = str(tmp_path / 'cache.sqlite')
+  first_cache = DiskCache(path)
+  first_cache.store('target', '1.0/', api_response(etag='"abc"'))
+  assert first_cache.fresh('target', '1.0/', first_cache.get('target', '1.0/')) is True
+  first_cache.close()
+
+  second_cache = DiskCache(path, max_age=None)
+  entry = second_cache.get('target', '1.0/')
+  assert entry is not None
+  assert second_cache.fresh('target', '1.0/', entry) is False
+  second_cache.validated('target', '1.0/')
+  assert second_cache.fresh('target', '1.0/', entry) is True
+
+# With the default max_age a new process uses recent entries without asking the server
+def test_cache_max_age(tmp_path):
+  path = str(tmp_path / 'cache.sqlite')
+  DiskCache(path).store('target', '1.0/', api_response())
+  entry = DiskCache(path).get('target', '1.0/')
+  assert DiskCache(path).fresh('target', '1.0/', entry) is True
+
+# max_age also limits how long an entry validated by this process is trusted
+def test_cache_max_age_limits_validated(tmp_path):
+  cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_age=60)
+  cache.store('target', '1.0/', api_response())
+  entry = cache.get('target', '1.0/')
+  with patch('container_client.cache.time.time', return_value=time.time() + 120):
+    assert cache.fresh('target', '1.0/', entry) is False
+
+def test_cache_corrupt_file(tmp_path):
+  path = tmp_path / 'cache.sqlite'
+  path.write_bytes(b'not a database' * 100)
+  cache = DiskCache(str(path))
+  cache.store('target', '1.0/', api_response())
+  cache.invalidate('target')
+  assert cache.get('target', '1.0/') is None
+
+def test_cache_locked_file(tmp_path):
+  path = str(tmp_path / 'cache.sqlite')
+  locker = sqlite3.connect(path)
+  locker.execute('BEGIN EXCLUSIVE')
+  cache = DiskCache(path, timeout=0.01)
+  cache.store('target', '1.0/', api_response())
+  assert cache.get('target', '1.0/') is None
+  locker.rollback()
+  locker.close()
+
+def test_cache_lru_eviction(tmp_path):
+  cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_size=20)
+  cache.store('target', '1.0/', api_response(b'0123456789'))
+  cache.store('target', '1.0/profiles', api_response(b'0123456789'))
+  # Use the first entry so the second is least recently used
+  cache.get('target', '1.0/')
+  cache.store('target', '1.0/networks', api_response(b'0123456789'))
+  assert cache.get('target', '1.0/') is not None
+  assert cache.get('target', '1.0/profiles') is None
+  assert cache.get('target', '1.0/networks') is not None
+
+def test_cache_too_large(tmp_path):
+  cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_size=5)
+  cache.store('target', '1.0/', api_response(b'0123456789'))
+  assert cache.get('target', '1.0/') is None
+
+def test_cache_invalidate(cache):
+  cache.store('target', '1.0/images', api_response())
+  cache.store('target', '1.0/images?recursion=1', api_response())
+  cache.store('target', '1.0/profiles', api_response())
+  cache.invalidate('target', '1.0/images')
+  assert cache.get('target', '1.0/images') is None
+  assert cache.get('target', '1.0/images?recursion=1') is None
+  assert cache.get('target', '1.0/profiles') is not None
+
+
+### Tests for Client.request using a cache
+
+@pytest.fixture
+def api_client(cache):
+  client = Client()
+  client.connection_target = '/path/to/socket'
+  client.cache = cache
+  return client
+
+def test_request_stores_and_reuses(api_client):
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(return_value=api_response(etag='"abc"'))
+    first = api_client.request(api_path='profiles')
+    second = api_client.request(api_path='profiles')
+  assert first.json() == second.json()
+  assert session.return_value.request.call_count == 1
+
+def test_request_validates_with_etag(api_client, cache):
+  cache.store('/path/to/socket', '1.0/profiles', api_response(b'{"metadata": ["cached"]}', etag='"abc"'))
+  # Fresh process which always checks with the server
+  cache.max_age = None
+  cache._validated = {}
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(return_value=api_response(b'', status_code=304))
+    result = api_client.request(api_path='profiles')
+    assert session.return_value.request.call_args.kwargs['headers'] == { 'If-None-Match': '"abc"' }
+    api_client.request(api_path='profiles')
+  assert result.json() == { 'metadata': ['cached'] }
+  assert session.return_value.request.call_count == 1
+
+def test_request_skips_uncached_paths(api_client, cache):
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(return_value=api_response())
+    api_client.request(api_path='instances')
+  assert cache.get('/path/to/socket', '1.0/instances') is None
+
+def test_request_write_invalidates(api_client, cache):
+  cache.store('/path/to/socket', '1.0/images?recursion=1', api_response())
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(return_value=api_response())
+    api_client.request(request_type='DELETE', api_path='images/abc')
+  assert cache.get('/path/to/socket', '1.0/images?recursion=1') is None
+
+def test_request_falls_back_when_cache_unusable(tmp_path):
+  path = tmp_path / 'cache.sqlite'
+  path.write_bytes(b'not a database' * 100)
+  client = Client()
+  client.connection_target = '/path/to/socket'
+  client.cache = DiskCache(str(path))
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(return_value=api_response(b'{"metadata": ["live"]}'))
+    assert client.request(api_path='images').json() == { 'metadata': ['live'] }
+
+# Data cached again while a write runs is cleared when its operation finishes
+def test_request_write_operation_invalidates_when_finished(api_client, cache):
+  operation_created = b'{"metadata": {"id": "abc", "status": "Running", "status_code": 103}}'
+  operation_finished = b'{"metadata": {"id": "abc", "status": "Success", "status_code": 200}}'
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(side_effect=[
+      api_response(b'{"metadata": ["old"]}'),
+      api_response(operation_created, status_code=202),
+      api_response(b'{"metadata": ["old"]}'),
+      api_response(operation_finished),
+      api_response(b'{"metadata": ["new"]}'),
+    ])
+    api_client.request(api_path='images')
+    operation = api_client.request(request_type='POST', api_path='images', post_json={})
+    api_client.request(api_path='images')
+    operation.wait()
+    assert api_client.request(api_path='images').json() == { 'metadata': ['new'] }
+
+# Data read while a synchronous write is in flight is cleared once the write returns
+def test_request_write_invalidates_when_finished(api_client, cache):
+  responses = iter([ api_response(b'{"metadata": ["old"]}'), api_response(b'{"metadata": ["new"]}') ])
+  def put_profile(method, url, json=None, headers=None):
+    # The server answers a read of the old data before this write completes
+    api_client.request(api_path='profiles?recursion=1')
+    return api_response()
+  def session_request(method, url, json=None, headers=None):
+    if method == 'PUT':
+      return put_profile(method, url, json=json, headers=headers)
+    return next(responses)
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(side_effect=session_request)
+    api_client.request(request_type='PUT', api_path='profiles/default', post_json={})
+    assert api_client.request(api_path='profiles?recursion=1').json() == { 'metadata': ['new'] }
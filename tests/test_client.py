@@ -1,9 +1,15 @@
 
+import copy
+import pickle
+import threading
+
 import pytest
 
+import requests
+
 from unittest.mock import MagicMock
 
-from container_client.client import Client
+from container_client.client import Client, Operation
 
 # Just import
 def test_class_smoketest():
@@ -112,6 +118,136 @@ def test_class_fn_poll_json_function_with_metadata_id_successful_validation():
 
 # TODO: test that poll_api handles invalid status codes? is that its problem?
 
+# Operations are handed to Operation.wait() rather than handled by poll_api
+def test_class_fn_poll_operation():
+  operation = MagicMock(spec=Operation)
+  api_client = Client()
+  api_client_poll = api_client.poll_api(returned_data=operation)
+  assert operation.wait.called == True
+  assert api_client_poll is operation.wait.return_value
+
+
+### Tests for Operation
+
+def operation_response(status_code=103, status='Running', metadata=None):
+  response = MagicMock()
+  response.status_code = 202
+  response.json = MagicMock(return_value={ 'metadata': { 'id': 'abc', 'status': status, 'status_code': status_code, 'metadata': metadata }})
+  return response
+
+def test_class_operation_passes_through_response():
+  response = operation_response()
+  operation = Operation(Client(), response)
+  assert operation.id == 'abc'
+  assert operation.status_code == 202
+  assert operation.json() == response.json()
+  assert operation.done() is False
+
+def test_class_operation_status_updates_metadata():
+  api_client = Client()
+  api_client.request = MagicMock(return_value=operation_response(metadata={ 'download_progress': 'rootfs: 45%' }))
+  operation = Operation(api_client, operation_response())
+  assert operation.status() == 'Running'
+  assert operation.metadata == { 'download_progress': 'rootfs: 45%' }
+  api_client.request.assert_called_with(api_path='operations/abc')
+
+def test_class_operation_status_error():
+  api_client = Client()
+  api_client.request = MagicMock(return_value=None)
+  operation = Operation(api_client, operation_response())
+  assert operation.status() is None
+
+def test_class_operation_wait_timeout():
+  api_client = Client()
+  api_client.request = MagicMock(return_value=operation_response())
+  operation = Operation(api_client, operation_response())
+  operation.wait(timeout=5)
+  api_client.request.assert_called_with(api_path='operations/abc/wait?timeout=5')
+  assert operation.done() is False
+
+def test_class_operation_wait_done_runs_callbacks():
+  finished = operation_response(status_code=200, status='Success')
+  api_client = Client()
+  api_client.request = MagicMock(return_value=finished)
+  operation = Operation(api_client, operation_response())
+  callback = MagicMock()
+  operation.add_done_callback(callback)
+  assert operation.wait() is finished
+  assert operation.done() is True
+  callback.assert_called_once_with(operation)
+  # Already finished; no further requests and new callbacks run immediately
+  assert operation.wait() is finished
+  assert api_client.request.call_count == 1
+  late_callback = MagicMock()
+  operation.add_done_callback(late_callback)
+  late_callback.assert_called_once_with(operation)
+
+def test_class_operation_finished_when_created():
+  response = operation_response(status_code=200, status='Success')
+  api_client = Client()
+  api_client.request = MagicMock()
+  operation = Operation(api_client, response)
+  assert operation.wait() is response
+  assert api_client.poll_api(operation) is response
+  assert api_client.request.called == False
+
+def test_class_operation_copy():
+  operation = Operation(Client(), operation_response())
+  operation_copy = copy.copy(operation)
+  assert operation_copy.id == 'abc'
+  assert operation_copy.response is operation.response
+
+def test_class_operation_pickle():
+  response = requests.models.Response()
+  response.status_code = 202
+  response._content = b'{"metadata": {"id": "abc", "status": "Running", "status_code": 103}}'
+  operation = pickle.loads(pickle.dumps(Operation(Client(), response)))
+  assert operation.id == 'abc'
+  callback = MagicMock()
+  operation.add_done_callback(callback)
+  assert callback.called == False
+
+def test_class_operation_finished_when_created_invalidates_cache():
+  api_client = Client()
+  api_client.cache = MagicMock()
+  Operation(api_client, operation_response(status_code=200, status='Success'), cache_invalidation=('target', '1.0/images'))
+  api_client.cache.invalidate.assert_called_once_with('target', '1.0/images')
+
+def test_class_operation_failing_callback_when_finished():
+  operation = Operation(Client(), operation_response(status_code=200, status='Success'))
+  operation.add_done_callback(MagicMock(side_effect=ValueError('callback failed')))
+
+# Several threads seeing the operation finish only run each callback once
+def test_class_operation_callbacks_run_once():
+  finished = operation_response(status_code=200, status='Success')
+  operation = Operation(Client(), operation_response())
+  callback = MagicMock()
+  operation.add_done_callback(callback)
+  barrier = threading.Barrier(8)
+  def update():
+    barrier.wait()
+    operation._update(finished)
+  threads = [ threading.Thread(target=update) for i in range(8) ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  callback.assert_called_once_with(operation)
+
+def test_class_operation_cancel():
+  api_client = Client()
+  api_client.request = MagicMock()
+  operation = Operation(api_client, operation_response())
+  assert operation.cancel() is True
+  api_client.request.assert_called_with(request_type='DELETE', api_path='operations/abc')
+
+def test_class_operation_cancel_finished():
+  api_client = Client()
+  api_client.request = MagicMock()
+  operation = Operation(api_client, operation_response(status_code=401, status='Canceled'))
+  assert operation.cancel() is False
+  assert api_client.request.called == False
+
 
 ### Tests for Client.request
 
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from container_client.client import Client, Operation
+from container_client.transport import Transport, RecordingTransport, ReplayTransport
+
+# Build a real requests.Response as the API would return it
+def api_response(content=b'{"metadata": {}}', status_code=200):
+  response = requests.models.Response()
+  response.status_code = status_code
+  response._content = content
+  return response
+
+operation_created = b'{"metadata": {"id": "abc", "status": "Running", "status_code": 103}}'
+operation_finished = b'{"metadata": {"id": "abc", "status": "Success", "status_code": 200}}'
+
+### Default transport
+
+def test_transport_uses_session():
+  session = MagicMock()
+  transport_request = Transport().request(session, 'GET', 'http://example.org/1.0/', body={ 'name': 'test' }, headers=None)
+  session.request.assert_called_once_with('GET', 'http://example.org/1.0/', json={ 'name': 'test' }, headers=None)
+  assert transport_request is session.request.return_value
+
+### Record, then replay without a server
+
+@pytest.fixture
+def recording(tmp_path):
+  path = str(tmp_path / 'recording.json')
+  api_client = Client()
+  api_client.connection_target = '/path/to/socket'
+  api_client.transport = RecordingTransport(path)
+  with patch('container_client.client.requests_unixsocket.Session') as session:
+    session.return_value.request = MagicMock(side_effect=[
+      api_response(b'{"metadata": ["/1.0/instances/test"]}'),
+      api_response(operation_created, status_code=202),
+      api_response(operation_created),
+      api_response(operation_finished),
+    ])
+    api_client.request(api_path='instances')
+    operation = api_client.request(request_type='POST', api_path='instances', post_json={ 'name': 'test' })
+    operation.wait(timeout=1)
+    operation.wait()
+  api_client.transport.save()
+  return path
+
+def test_recording_saved(recording):
+  replay = ReplayTransport(recording)
+  assert len(replay.responses) == 4
+
+def test_replay_request_and_operation(recording):
+  api_client = Client()
+  api_client.connection_target = '/path/to/socket'
+  api_client.transport = ReplayTransport(recording)
+
+  assert api_client.request(api_path='instances').json() == { 'metadata': ['/1.0/instances/test'] }
+  operation = api_client.request(request_type='POST', api_path='instances', post_json={ 'name': 'test' })
+  assert isinstance(operation, Operation)
+  operation.wait(timeout=1)
+  assert operation.done() is False
+  assert api_client.poll_api(operation).json()['metadata']['status'] == 'Success'
+  assert operation.done() is True
+
+def test_replay_cycles_answers(recording):
+  replay = ReplayTransport(recording)
+  url = 'http+unix://%2Fpath%2Fto%2Fsocket/1.0/instances'
+  first = replay.request(None, 'GET', url)
+  assert replay.request(None, 'GET', url) is first
+
+def test_replay_unknown_request(recording):
+  api_client = Client()
+  api_client.connection_target = '/path/to/socket'
+  api_client.transport = ReplayTransport(recording)
+  assert api_client.request(api_path='profiles') is None
+
+def test_replay_realtime(recording):
+  replay = ReplayTransport(recording, realtime=True)
+  with patch('container_client.transport.time.sleep') as sleep:
+    replay.request(None, 'GET', 'http+unix://%2Fpath%2Fto%2Fsocket/1.0/instances')
+  assert sleep.called == True
+
+def test_replay_threads_share_positions(tmp_path):
+  path = str(tmp_path / 'recording.json')
+  recorder = RecordingTransport(path)
+  session = MagicMock()
+  session.request = MagicMock(side_effect=[ api_response(operation_created), api_response(operation_created), api_response(operation_finished) ])
+  for i in range(3):
+    recorder.request(session, 'GET', 'http://example.org/1.0/operations/abc')
+  recorder.save()
+
+  replay = ReplayTransport(path)
+  threads = [ threading.Thread(target=lambda: [ replay.request(None, 'GET', 'http://example.org/1.0/operations/abc') for i in range(1000) ])
+              for i in range(4) ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  # 4000 answers from 3 recorded; none lost, so the next answer is the second
+  assert replay._positions[('GET', '1.0/operations/abc', None)] == 4000 % 3
+
+# Recordings aren't tied to the target they were made against
+def test_replay_other_target(recording):
+  api_client = Client()
+  api_client.connection_target = 'https://incus.example.org:8443/'
+  api_client.transport = ReplayTransport(recording)
+  assert api_client.request(api_path='instances').json() == { 'metadata': ['/1.0/instances/test'] }